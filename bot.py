@@ -1,19 +1,33 @@
 #!/usr/bin/env python3
 import logging
 import asyncio
+import random
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from functools import partial
+from typing import NamedTuple
 from cachetools import TTLCache
 
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ChatPermissions
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
-    Application, CommandHandler, MessageHandler, 
-    CallbackQueryHandler, filters, ContextTypes
+    Application, CommandHandler, MessageHandler,
+    CallbackQueryHandler, ChatMemberHandler, filters, ContextTypes
 )
 from telegram.constants import ParseMode
+from telegram.error import BadRequest, Forbidden, RetryAfter, TelegramError
 
-from config import BOT_TOKEN, DEFAULT_WARN_LIMIT
+from config import (
+    BOT_TOKEN, DEFAULT_WARN_LIMIT, DEFAULT_ANTIFLOOD_COUNT,
+    DEFAULT_ANTIFLOOD_SECONDS, DEFAULT_WELCOME_MESSAGE, DEFAULT_RULES
+)
 from database import Database
-from utils import parse_time, format_time, create_mute_permissions, is_admin
+from utils import (
+    parse_time, format_time, create_mute_permissions,
+    create_default_permissions, is_admin, invalidate_admin_cache,
+    get_cached_admins
+)
 
 # Настройка логирования
 logging.basicConfig(
@@ -25,12 +39,174 @@ logger = logging.getLogger(__name__)
 # Инициализация БД
 db = Database()
 
+# SQLite поддерживает только одного писателя: все обращения к БД идут
+# через выделенный поток, а не через общий пул asyncio.to_thread
+_db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db")
+
+async def db_call(fn, *args, **kwargs):
+    """Выполняет синхронный вызов БД в выделенном DB-потоке"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_executor, partial(fn, *args, **kwargs))
+
+# Читающие вызовы идут через свой пул потоков: под WAL чтения
+# выполняются параллельно и не стоят в очереди за писателем
+_db_read_executor = ThreadPoolExecutor(
+    max_workers=Database.READ_POOL_SIZE, thread_name_prefix="db-read"
+)
+
+async def db_read(fn, *args, **kwargs):
+    """Выполняет читающий вызов БД в пуле читающих потоков"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_read_executor, partial(fn, *args, **kwargs))
+
 # Кэш для антифлуда (хранит время сообщений пользователей)
 # {chat_id_user_id: [timestamps]}
 flood_cache = TTLCache(maxsize=10000, ttl=60)
 
-# Кэш для проверки админов (чтобы не дудосить Telegram API)
-admin_cache = TTLCache(maxsize=1000, ttl=300)  # 5 минут
+# Кэши настроек чата и плохих слов (меняются редко, читаются на каждое сообщение)
+settings_cache = TTLCache(maxsize=1000, ttl=300)
+badwords_cache = TTLCache(maxsize=1000, ttl=300)
+
+class ChatConfig(NamedTuple):
+    """Замороженные настройки чата: дефолты подставлены при загрузке,
+    горячий путь читает атрибуты вместо dict.get с дефолтом"""
+    warn_limit: int = DEFAULT_WARN_LIMIT
+    antiflood_enabled: bool = True
+    antiflood_count: int = DEFAULT_ANTIFLOOD_COUNT
+    antiflood_seconds: int = DEFAULT_ANTIFLOOD_SECONDS
+    welcome_message: str = DEFAULT_WELCOME_MESSAGE
+    rules: str = DEFAULT_RULES
+
+async def cached_settings(chat_id):
+    """Настройки чата (ChatConfig) через кэш, с фолбэком в БД"""
+    cfg = settings_cache.get(chat_id)
+    if cfg is None:
+        row = await db_read(db.get_chat_settings, chat_id)
+        if row is None:
+            # Новый чат: строку по умолчанию вставляет только писатель
+            row = await db_call(db.ensure_chat_settings, chat_id)
+        cfg = ChatConfig(
+            warn_limit=row.get('warn_limit') or DEFAULT_WARN_LIMIT,
+            antiflood_enabled=bool(row.get('antiflood_enabled', 1)),
+            antiflood_count=row.get('antiflood_count') or DEFAULT_ANTIFLOOD_COUNT,
+            antiflood_seconds=row.get('antiflood_seconds') or DEFAULT_ANTIFLOOD_SECONDS,
+            welcome_message=row.get('welcome_message') or DEFAULT_WELCOME_MESSAGE,
+            rules=row.get('rules') or DEFAULT_RULES,
+        )
+        settings_cache[chat_id] = cfg
+    return cfg
+
+async def cached_badwords(chat_id):
+    """Список плохих слов и скомпилированный паттерн через кэш, с фолбэком в БД
+
+    Компиляцией владеет Database: паттерн собирается один раз на чат
+    и переиспользуется здесь без повторного re.compile.
+    """
+    cached = badwords_cache.get(chat_id)
+    if cached is None:
+        cached = await db_read(db.get_bad_words_compiled, chat_id)
+        badwords_cache[chat_id] = cached
+    return cached
+
+# Генератор для капчи (модульный, чтобы не дергать import в обработчике
+# и можно было подменить сид в тестах)
+_rng = random.Random()
+
+# Активные капчи: (chat_id, user_id) -> правильный ответ, истекают сами
+captcha_cache = TTLCache(maxsize=1000, ttl=120)
+
+# Очередь обновлений статистики: обработчики только кладут кортежи,
+# фоновая задача пишет их в БД пакетами
+stats_queue = asyncio.Queue()
+STATS_BATCH_SIZE = 50
+STATS_FLUSH_INTERVAL = 1.0  # секунд
+
+async def stats_flusher():
+    """Фоновая задача: пишет статистику в БД пакетами, а не по одной строке"""
+    while True:
+        batch = [await stats_queue.get()]
+        try:
+            # Добираем элементы до размера пакета или до таймаута
+            while len(batch) < STATS_BATCH_SIZE:
+                batch.append(await asyncio.wait_for(
+                    stats_queue.get(), timeout=STATS_FLUSH_INTERVAL
+                ))
+        except asyncio.TimeoutError:
+            pass
+        try:
+            await db_call(db.bulk_update_user_stats, batch)
+        except Exception:
+            # Не даем одной неудачной записи (например, SQLITE_BUSY)
+            # убить задачу: пакет теряем, но флашер живет дальше
+            logger.exception("Ошибка пакетной записи статистики")
+
+DB_MAINTENANCE_INTERVAL = 600  # секунд
+
+async def db_maintenance_loop():
+    """Фоновая задача: периодически усекает WAL и подчищает БД"""
+    while True:
+        await asyncio.sleep(DB_MAINTENANCE_INTERVAL)
+        try:
+            await db_call(db.maintenance)
+        except Exception:
+            logger.exception("Ошибка обслуживания БД")
+
+# === СТАТИЧЕСКИЕ ТЕКСТЫ И КЛАВИАТУРЫ ===
+# Собираются один раз при импорте; InlineKeyboardMarkup неизменяем,
+# поэтому делить один экземпляр между чатами безопасно
+
+HELP_TEXT = """
+🤖 **Доступные команды:**
+
+**👑 Для админов:**
+• /ban - забанить пользователя
+• /unban - разбанить
+• /mute [время] - заглушить (1h, 1d, 30m)
+• /unmute - снять заглушение
+• /warn [причина] - выдать предупреждение
+• /unwarn - снять предупреждение
+• /clear [N] - удалить N сообщений
+• /pin - закрепить сообщение
+• /slowmode [сек] - медленный режим
+
+**👥 Для всех:**
+• /report - пожаловаться на сообщение
+• /info - информация о пользователе
+• /rules - правила чата
+• /help - это сообщение
+
+**💡 Советы:**
+• Для большинства команд ответьте на сообщение пользователя
+• Время указывается цифрой и буквой: 5m, 2h, 1d
+"""
+
+STATUS_MAP = {
+    'creator': 'Создатель',
+    'administrator': 'Админ',
+    'member': 'Участник',
+    'restricted': 'Ограничен',
+    'left': 'Покинул',
+    'kicked': 'Забанен'
+}
+
+RULES_KEYBOARD = InlineKeyboardMarkup(
+    [[InlineKeyboardButton("✅ Принимаю правила", callback_data="accept_rules")]]
+)
+
+ACCEPT_RULES_KEYBOARD = InlineKeyboardMarkup(
+    [[InlineKeyboardButton("✅ Принять", callback_data="accept_rules")]]
+)
+
+CAPTCHA_KEYBOARD = InlineKeyboardMarkup(
+    [[InlineKeyboardButton("Решить капчу", callback_data="solve_captcha")]]
+)
+
+MAIN_MENU_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📜 Правила", callback_data="menu_rules")],
+    [InlineKeyboardButton("ℹ️ Моя информация", callback_data="menu_info")],
+    [InlineKeyboardButton("🆘 Помощь", callback_data="menu_help")],
+    [InlineKeyboardButton("🚨 Пожаловаться", callback_data="menu_report")]
+])
 
 # === КОМАНДЫ МОДЕРАЦИИ ===
 
@@ -124,7 +300,7 @@ async def mute_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         
         # Сохраняем в БД
-        db.add_mute(chat.id, user_to_mute.id, duration)
+        await db_call(db.add_mute, chat.id, user_to_mute.id, duration)
         
         await message.reply_text(
             f"🔇 Пользователь {user_to_mute.full_name} заглушен на {format_time(duration)}."
@@ -151,11 +327,11 @@ async def unmute_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Возвращаем обычные права
         await chat.restrict_member(
             user_to_unmute.id,
-            permissions=ChatPermissions(can_send_messages=True)
+            permissions=create_default_permissions()
         )
         
         # Удаляем из БД
-        db.remove_mute(chat.id, user_to_unmute.id)
+        await db_call(db.remove_mute, chat.id, user_to_unmute.id)
         
         await message.reply_text(f"🔊 Пользователь {user_to_unmute.full_name} разблокирован.")
     except Exception as e:
@@ -177,18 +353,16 @@ async def warn_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_to_warn = message.reply_to_message.from_user
     reason = ' '.join(context.args) if context.args else "Без причины"
     
-    # Добавляем предупреждение
-    warn_count = db.add_warning(chat.id, user_to_warn.id, update.effective_user.id, reason)
-    
-    # Получаем лимит из настроек чата
-    settings = db.get_chat_settings(chat.id)
-    warn_limit = settings.get('warn_limit', DEFAULT_WARN_LIMIT)
-    
+    # Добавляем предупреждение (количество и лимит возвращаются одним запросом)
+    warn_count, warn_limit = await db_call(
+        db.add_warning, chat.id, user_to_warn.id, update.effective_user.id, reason
+    )
+
     if warn_count >= warn_limit:
         # Превышен лимит - баним
         try:
             await chat.ban_member(user_to_warn.id)
-            db.clear_warnings(chat.id, user_to_warn.id)
+            await db_call(db.clear_warnings, chat.id, user_to_warn.id)
             await message.reply_text(
                 f"🚫 {user_to_warn.full_name} получил {warn_count}/{warn_limit} предупреждений и был забанен.\n"
                 f"Причина последнего: {reason}"
@@ -217,7 +391,7 @@ async def unwarn_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_to_unwarn = message.reply_to_message.from_user
     
     # Удаляем предупреждение
-    warn_count = db.remove_warning(chat.id, user_to_unwarn.id)
+    warn_count = await db_call(db.remove_warning, chat.id, user_to_unwarn.id)
     
     await message.reply_text(
         f"✅ С пользователя {user_to_unwarn.full_name} снято предупреждение.\n"
@@ -248,26 +422,43 @@ async def clear_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     deleted = 0
     try:
         if message.reply_to_message:
-            # Удаляем начиная с ответного сообщения
+            # Bulk-удаление: один вызов deleteMessages на пачку до 100 ID
             message_id = message.reply_to_message.message_id
-            for i in range(count):
-                try:
-                    await chat.delete_message(message_id + i)
-                    deleted += 1
-                    await asyncio.sleep(0.5)  # Защита от лимитов
-                except:
-                    pass
+            ids = list(range(message_id, message_id + count))
+            try:
+                if await context.bot.delete_messages(chat_id=chat.id, message_ids=ids):
+                    deleted = len(ids)
+            except BadRequest:
+                # Часть ID могла не существовать — добиваем по одному
+                sem = asyncio.Semaphore(25)
+
+                async def delete_one(msg_id):
+                    async with sem:
+                        try:
+                            await chat.delete_message(msg_id)
+                            return 1
+                        except (BadRequest, Forbidden):
+                            return 0
+
+                results = await asyncio.gather(*(delete_one(i) for i in ids))
+                deleted = sum(results)
         else:
             # Удаляем последние N сообщений (не работает в группах без супергруппы)
             await message.reply_text("❌ Для очистки без ответа нужна супергруппа. Ответьте на сообщение!")
             return
-        
+
         result_msg = await message.reply_text(f"✅ Удалено {deleted} сообщений.")
-        
-        # Удаляем команду и результат через 3 секунды
-        await asyncio.sleep(3)
-        await message.delete()
-        await result_msg.delete()
+
+        # Удаляем команду и результат фоном, не задерживая обработчик
+        async def cleanup():
+            await asyncio.sleep(3)
+            try:
+                await message.delete()
+                await result_msg.delete()
+            except (BadRequest, Forbidden):
+                pass
+
+        context.application.create_task(cleanup())
     except Exception as e:
         await message.reply_text(f"❌ Ошибка: {str(e)}")
 
@@ -335,9 +526,9 @@ async def report_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     reporter = update.effective_user
     reported_user = reported_msg.from_user
     
-    # Ищем администраторов в чате
+    # Ищем администраторов в чате (через кэш)
     chat = update.effective_chat
-    admins = await chat.get_administrators()
+    admins = await get_cached_admins(chat)
     
     # Отправляем жалобу в личные сообщения админам
     report_text = (
@@ -348,19 +539,41 @@ async def report_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"[Перейти к сообщению]({reported_msg.link})"
     )
     
-    sent_count = 0
-    for admin in admins:
-        if not admin.user.is_bot:
+    targets = [admin.user.id for admin in admins if not admin.user.is_bot]
+
+    # Рассылаем параллельно, но не больше 10 запросов одновременно
+    sem = asyncio.Semaphore(10)
+
+    async def send_one(user_id):
+        async with sem:
             try:
                 await context.bot.send_message(
-                    admin.user.id,
+                    user_id,
                     report_text,
                     parse_mode=ParseMode.MARKDOWN
                 )
-                sent_count += 1
-            except:
-                pass
-    
+                return 1
+            except RetryAfter as e:
+                # Уперлись в лимит — ждем, сколько сказал Telegram, и пробуем еще раз
+                await asyncio.sleep(e.retry_after)
+                try:
+                    await context.bot.send_message(
+                        user_id,
+                        report_text,
+                        parse_mode=ParseMode.MARKDOWN
+                    )
+                    return 1
+                except TelegramError:
+                    # Снова лимит или личка закрыта — сдаемся по этому админу
+                    return 0
+            except TelegramError:
+                # Админ не открывал личку с ботом, сеть моргнула и т.п. —
+                # пропускаем, не роняя остальную рассылку
+                return 0
+
+    results = await asyncio.gather(*(send_one(user_id) for user_id in targets))
+    sent_count = sum(results)
+
     await message.reply_text(f"✅ Жалоба отправлена {sent_count} администраторам.")
 
 async def info_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -379,23 +592,15 @@ async def info_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         target_user = update.effective_user
     
-    # Получаем статистику
-    stats = db.get_user_stats(chat.id, target_user.id)
-    warns = db.get_warnings_count(chat.id, target_user.id)
-    is_muted_user = db.is_muted(chat.id, target_user.id)
+    # Получаем статистику, предупреждения и статус мута одним запросом
+    overview = await db_read(db.get_user_overview, chat.id, target_user.id)
+    warns = overview['warnings_count']
+    is_muted_user = overview['is_muted']
     
     # Получаем информацию о пользователе из чата
     try:
         chat_member = await chat.get_member(target_user.id)
-        status_map = {
-            'creator': 'Создатель',
-            'administrator': 'Админ',
-            'member': 'Участник',
-            'restricted': 'Ограничен',
-            'left': 'Покинул',
-            'kicked': 'Забанен'
-        }
-        status = status_map.get(chat_member.status, chat_member.status)
+        status = STATUS_MAP.get(chat_member.status, chat_member.status)
     except:
         status = "Неизвестно"
     
@@ -410,12 +615,15 @@ async def info_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"**Статус мута:** {'🔇 Да' if is_muted_user else '🔊 Нет'}\n"
     )
     
-    if stats:
+    if overview['messages_count'] is not None:
+        # Время хранится как unix-секунды — форматируем только для вывода
+        first_seen = datetime.fromtimestamp(overview['first_seen'])
+        last_seen = datetime.fromtimestamp(overview['last_seen'])
         info_text += (
             f"\n**Статистика:**\n"
-            f"**Сообщений:** {stats['messages_count']}\n"
-            f"**Впервые:** {stats['first_seen']}\n"
-            f"**Последний раз:** {stats['last_seen']}\n"
+            f"**Сообщений:** {overview['messages_count']}\n"
+            f"**Впервые:** {first_seen:%Y-%m-%d %H:%M}\n"
+            f"**Последний раз:** {last_seen:%Y-%m-%d %H:%M}\n"
         )
     
     await message.reply_text(info_text, parse_mode=ParseMode.MARKDOWN)
@@ -423,110 +631,89 @@ async def info_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def rules_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показать правила (/rules)"""
     chat_id = update.effective_chat.id
-    settings = db.get_chat_settings(chat_id)
-    
-    keyboard = [[InlineKeyboardButton("✅ Принимаю правила", callback_data="accept_rules")]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
+    settings = await cached_settings(chat_id)
+
     await update.message.reply_text(
-        settings.get('rules', "Правила не установлены."),
-        reply_markup=reply_markup
+        settings.rules,
+        reply_markup=RULES_KEYBOARD
     )
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показать помощь (/help)"""
-    help_text = """
-🤖 **Доступные команды:**
-
-**👑 Для админов:**
-• /ban - забанить пользователя
-• /unban - разбанить
-• /mute [время] - заглушить (1h, 1d, 30m)
-• /unmute - снять заглушение
-• /warn [причина] - выдать предупреждение
-• /unwarn - снять предупреждение
-• /clear [N] - удалить N сообщений
-• /pin - закрепить сообщение
-• /slowmode [сек] - медленный режим
-
-**👥 Для всех:**
-• /report - пожаловаться на сообщение
-• /info - информация о пользователе
-• /rules - правила чата
-• /help - это сообщение
-
-**💡 Советы:**
-• Для большинства команд ответьте на сообщение пользователя
-• Время указывается цифрой и буквой: 5m, 2h, 1d
-"""
-    await update.message.reply_text(help_text, parse_mode=ParseMode.MARKDOWN)
+    await update.message.reply_text(HELP_TEXT, parse_mode=ParseMode.MARKDOWN)
 
 async def menu_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показать меню с кнопками"""
-    keyboard = [
-        [InlineKeyboardButton("📜 Правила", callback_data="menu_rules")],
-        [InlineKeyboardButton("ℹ️ Моя информация", callback_data="menu_info")],
-        [InlineKeyboardButton("🆘 Помощь", callback_data="menu_help")],
-        [InlineKeyboardButton("🚨 Пожаловаться", callback_data="menu_report")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
     await update.message.reply_text(
         "📋 **Главное меню**\nВыберите действие:",
-        reply_markup=reply_markup,
+        reply_markup=MAIN_MENU_KEYBOARD,
         parse_mode=ParseMode.MARKDOWN
     )
 
 # === ОБРАБОТЧИКИ СОБЫТИЙ ===
 
+async def _handle_one_new_member(update, context, settings, new_member):
+    """Обработка одного нового участника (запускается параллельно)"""
+    chat = update.effective_chat
+
+    # Проверка на подозрительность (аккаунт младше 7 дней).
+    # У telegram.User нет created_at — getattr, чтобы не падать на каждом
+    # входе; без даты считаем аккаунт старым
+    created_at = getattr(new_member, 'created_at', None)
+    account_age = (datetime.now() - created_at).days if created_at else 999
+    is_suspicious = account_age < 7
+
+    welcome_text = settings.welcome_message.format(name=new_member.full_name)
+
+    if is_suspicious:
+        welcome_text += "\n\n⚠️ **Внимание:** Ваш аккаунт слишком новый. Пройдите проверку:"
+
+        # Создаем капчу
+        num1 = _rng.randint(1, 10)
+        num2 = _rng.randint(1, 10)
+
+        # Сохраняем ответ в кэше с TTL — капча сама истечет
+        captcha_cache[(chat.id, new_member.id)] = num1 + num2
+
+        await update.message.reply_text(
+            f"{welcome_text}\n\n{num1} + {num2} = ?",
+            reply_markup=CAPTCHA_KEYBOARD
+        )
+
+        # Ограничиваем права нового пользователя
+        await chat.restrict_member(
+            new_member.id,
+            permissions=create_mute_permissions()
+        )
+    else:
+        await update.message.reply_text(welcome_text)
+
 async def handle_new_members(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Приветствие новых участников"""
     chat = update.effective_chat
-    settings = db.get_chat_settings(chat.id)
-    
-    for new_member in update.message.new_chat_members:
-        # Пропускаем ботов
-        if new_member.is_bot:
-            continue
-        
-        # Проверка на подозрительность (аккаунт младше 7 дней)
-        account_age = (datetime.now() - new_member.created_at).days if new_member.created_at else 999
-        is_suspicious = account_age < 7
-        
-        welcome_text = settings.get('welcome_message', DEFAULT_WELCOME_MESSAGE)
-        welcome_text = welcome_text.format(name=new_member.full_name)
-        
-        if is_suspicious:
-            welcome_text += "\n\n⚠️ **Внимание:** Ваш аккаунт слишком новый. Пройдите проверку:"
-            
-            # Создаем капчу
-            import random
-            num1 = random.randint(1, 10)
-            num2 = random.randint(1, 10)
-            captcha_answer = num1 + num2
-            
-            # Сохраняем ответ в контексте
-            context.user_data['captcha'] = {
-                'chat_id': chat.id,
-                'user_id': new_member.id,
-                'answer': captcha_answer
-            }
-            
-            keyboard = [[InlineKeyboardButton("Решить капчу", callback_data="solve_captcha")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await update.message.reply_text(
-                f"{welcome_text}\n\n{num1} + {num2} = ?",
-                reply_markup=reply_markup
-            )
-            
-            # Ограничиваем права нового пользователя
-            await chat.restrict_member(
-                new_member.id,
-                permissions=ChatPermissions(can_send_messages=False)
+    settings = await cached_settings(chat.id)
+
+    # Обрабатываем всех вошедших параллельно — при массовом заходе
+    # рестрикты и приветствия не выстраиваются в очередь
+    members = [m for m in update.message.new_chat_members if not m.is_bot]
+    if not members:
+        return
+    results = await asyncio.gather(
+        *(_handle_one_new_member(update, context, settings, m) for m in members),
+        return_exceptions=True
+    )
+    # return_exceptions не дает одному сбою отменить остальных,
+    # но ошибки обязаны попасть в лог
+    for member, result in zip(members, results):
+        if isinstance(result, Exception):
+            logger.error(
+                "Ошибка обработки нового участника %s в чате %s",
+                member.id, chat.id, exc_info=result
             )
-        else:
-            await update.message.reply_text(welcome_text)
+
+async def handle_chat_member_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Сброс кэша админов при изменении состава участников"""
+    invalidate_admin_cache(update.effective_chat.id)
 
 async def handle_left_member(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка выхода участника"""
@@ -544,38 +731,43 @@ async def handle_messages(update: Update, context: ContextTypes.DEFAULT_TYPE):
     message = update.message
     
     # Проверяем, не заглушен ли пользователь
-    if db.is_muted(chat.id, user.id):
+    if await db_read(db.is_muted, chat.id, user.id):
         try:
             await message.delete()
-        except:
+        except (BadRequest, Forbidden):
             pass
         return
     
-    # Обновляем статистику
-    db.update_user_stats(chat.id, user.id, user.username, user.first_name)
-    
-    # Получаем настройки чата
-    settings = db.get_chat_settings(chat.id)
+    # Обновляем статистику (кладем в очередь, фоновая задача запишет пакетом)
+    stats_queue.put_nowait((chat.id, user.id, time.time()))
     
+    # Получаем настройки чата и список плохих слов (оба из кэша)
+    settings = await cached_settings(chat.id)
+    bad_words, badwords_pattern = await cached_badwords(chat.id)
+
+    # Обе фичи выключены — дальше делать нечего
+    if not settings.antiflood_enabled and not badwords_pattern:
+        return
+
     # АНТИФЛУД
-    if settings.get('antiflood_enabled', True):
-        cache_key = f"{chat.id}_{user.id}"
-        
-        if cache_key not in flood_cache:
-            flood_cache[cache_key] = []
-        
-        # Добавляем текущее время
-        current_time = datetime.now().timestamp()
-        flood_cache[cache_key].append(current_time)
-        
-        # Удаляем старые записи
-        flood_cache[cache_key] = [
-            t for t in flood_cache[cache_key] 
-            if current_time - t <= settings.get('antiflood_seconds', 10)
-        ]
-        
-        # Проверяем количество сообщений за период
-        if len(flood_cache[cache_key]) > settings.get('antiflood_count', 5):
+    if settings.antiflood_enabled:
+        # Кортеж хэшируется быстрее, чем отформатированная строка
+        cache_key = (chat.id, user.id)
+        limit = settings.antiflood_count
+        window = settings.antiflood_seconds
+
+        timestamps = flood_cache.get(cache_key)
+        if timestamps is None:
+            # deque с maxlen сам вытесняет старые записи — без пересборки списка
+            timestamps = deque(maxlen=limit + 1)
+            flood_cache[cache_key] = timestamps
+
+        # Монотонные часы: без аллокации datetime на каждое сообщение
+        current_time = time.monotonic()
+        timestamps.append(current_time)
+
+        # Флуд: больше limit сообщений уложилось в окно
+        if len(timestamps) > limit and current_time - timestamps[0] <= window:
             # Флуд! Заглушаем на 5 минут
             try:
                 await message.delete()
@@ -583,48 +775,50 @@ async def handle_messages(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 mute_until = datetime.now() + timedelta(minutes=5)
                 await chat.restrict_member(
                     user.id,
-                    permissions=ChatPermissions(can_send_messages=False),
+                    permissions=create_mute_permissions(),
                     until_date=mute_until
                 )
                 
-                db.add_mute(chat.id, user.id, 300)  # 5 минут
+                await db_call(db.add_mute, chat.id, user.id, 300)  # 5 минут
                 
                 await context.bot.send_message(
                     chat.id,
                     f"🚫 {user.full_name} заглушен на 5 минут за флуд."
                 )
-            except:
+            except (BadRequest, Forbidden):
                 pass
             return
     
-    # АНТИ-МАТ
-    bad_words = db.get_bad_words(chat.id)
-    if bad_words:
-        text_lower = message.text.lower()
-        for word in bad_words:
-            if word.lower() in text_lower:
-                try:
-                    await message.delete()
-                    
-                    # Выдаем предупреждение
-                    warn_count = db.add_warning(chat.id, user.id, context.bot.id, f"Мат: {word}")
-                    
+    # АНТИ-МАТ (паттерн скомпилирован с IGNORECASE — без .lower() и
+    # лишней копии текста на каждое сообщение)
+    if badwords_pattern:
+        match = badwords_pattern.search(message.text)
+        if match:
+            word = match.group(0).lower()
+            try:
+                await message.delete()
+
+                # Выдаем предупреждение
+                warn_count, warn_limit = await db_call(
+                    db.add_warning, chat.id, user.id, context.bot.id, f"Мат: {word}"
+                )
+
+                await context.bot.send_message(
+                    chat.id,
+                    f"⚠️ {user.full_name}, использование запрещенных слов запрещено!\n"
+                    f"Предупреждение {warn_count}/{warn_limit}"
+                )
+
+                # Проверяем лимит предупреждений
+                if warn_count >= warn_limit:
+                    await chat.ban_member(user.id)
                     await context.bot.send_message(
                         chat.id,
-                        f"⚠️ {user.full_name}, использование запрещенных слов запрещено!\n"
-                        f"Предупреждение {warn_count}/{settings.get('warn_limit', 3)}"
+                        f"🚫 {user.full_name} забанен за превышение лимита предупреждений."
                     )
-                    
-                    # Проверяем лимит предупреждений
-                    if warn_count >= settings.get('warn_limit', 3):
-                        await chat.ban_member(user.id)
-                        await context.bot.send_message(
-                            chat.id,
-                            f"🚫 {user.full_name} забанен за превышение лимита предупреждений."
-                        )
-                except:
-                    pass
-                return
+            except (BadRequest, Forbidden):
+                pass
+            return
 
 # === ОБРАБОТЧИКИ КНОПОК ===
 
@@ -641,36 +835,31 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.edit_message_text("✅ Спасибо! Правила приняты.")
         
         # Если пользователь был ограничен, снимаем ограничения
-        if db.is_muted(chat.id, user.id):
-            db.remove_mute(chat.id, user.id)
+        if await db_read(db.is_muted, chat.id, user.id):
+            await db_call(db.remove_mute, chat.id, user.id)
             await chat.restrict_member(
                 user.id,
-                permissions=ChatPermissions(can_send_messages=True)
+                permissions=create_default_permissions()
             )
     
     elif data == "solve_captcha":
-        if 'captcha' in context.user_data:
-            captcha = context.user_data['captcha']
-            if captcha['user_id'] == user.id and captcha['chat_id'] == chat.id:
-                await query.edit_message_text(
-                    "✅ Капча решена! Напишите ответ в чат."
-                )
-            else:
-                await query.edit_message_text("❌ Это не ваша капча!")
+        if (chat.id, user.id) in captcha_cache:
+            await query.edit_message_text(
+                "✅ Капча решена! Напишите ответ в чат."
+            )
         else:
-            await query.edit_message_text("❌ Капча не найдена!")
+            await query.edit_message_text("❌ Капча не найдена или истекла!")
     
     elif data == "menu_rules":
-        settings = db.get_chat_settings(chat.id)
-        keyboard = [[InlineKeyboardButton("✅ Принять", callback_data="accept_rules")]]
+        settings = await cached_settings(chat.id)
         await query.edit_message_text(
-            settings.get('rules', "Правила не установлены."),
-            reply_markup=InlineKeyboardMarkup(keyboard)
+            settings.rules,
+            reply_markup=ACCEPT_RULES_KEYBOARD
         )
     
     elif data == "menu_info":
-        stats = db.get_user_stats(chat.id, user.id)
-        warns = db.get_warnings_count(chat.id, user.id)
+        stats = await db_read(db.get_user_stats, chat.id, user.id)
+        warns = await db_read(db.get_warnings_count, chat.id, user.id)
         
         text = f"**Ваша информация:**\n\nID: `{user.id}`\n"
         text += f"Предупреждений: {warns}\n"
@@ -707,7 +896,8 @@ async def set_welcome_command(update: Update, context: ContextTypes.DEFAULT_TYPE
     welcome_text = ' '.join(context.args)
     chat_id = update.effective_chat.id
     
-    db.update_welcome(chat_id, welcome_text)
+    await db_call(db.update_welcome, chat_id, welcome_text)
+    settings_cache.pop(chat_id, None)
     await update.message.reply_text("✅ Приветствие обновлено!")
 
 async def set_rules_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -723,7 +913,8 @@ async def set_rules_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     rules_text = ' '.join(context.args)
     chat_id = update.effective_chat.id
     
-    db.update_rules(chat_id, rules_text)
+    await db_call(db.update_rules, chat_id, rules_text)
+    settings_cache.pop(chat_id, None)
     await update.message.reply_text("✅ Правила обновлены!")
 
 async def add_badword_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -739,10 +930,11 @@ async def add_badword_command(update: Update, context: ContextTypes.DEFAULT_TYPE
     word = context.args[0].lower()
     chat_id = update.effective_chat.id
     
-    bad_words = db.get_bad_words(chat_id)
+    bad_words = await db_read(db.get_bad_words, chat_id)
     if word not in bad_words:
         bad_words.append(word)
-        db.update_bad_words(chat_id, bad_words)
+        await db_call(db.update_bad_words, chat_id, bad_words)
+        badwords_cache.pop(chat_id, None)
         await update.message.reply_text(f"✅ Слово '{word}' добавлено в черный список!")
     else:
         await update.message.reply_text(f"⚠️ Слово '{word}' уже в списке!")
@@ -760,20 +952,51 @@ async def remove_badword_command(update: Update, context: ContextTypes.DEFAULT_T
     word = context.args[0].lower()
     chat_id = update.effective_chat.id
     
-    bad_words = db.get_bad_words(chat_id)
+    bad_words = await db_read(db.get_bad_words, chat_id)
     if word in bad_words:
         bad_words.remove(word)
-        db.update_bad_words(chat_id, bad_words)
+        await db_call(db.update_bad_words, chat_id, bad_words)
+        badwords_cache.pop(chat_id, None)
         await update.message.reply_text(f"✅ Слово '{word}' удалено из черного списка!")
     else:
         await update.message.reply_text(f"⚠️ Слово '{word}' не найдено в списке!")
 
 # === ОСНОВНАЯ ФУНКЦИЯ ===
 
+async def global_error_handler(update, context):
+    """Центральный обработчик: логируем все неперехваченные ошибки"""
+    logger.error("Ошибка при обработке апдейта %s", update, exc_info=context.error)
+
+async def post_init(application):
+    """Запуск фоновых задач после инициализации приложения"""
+    application.create_task(stats_flusher())
+    application.create_task(db_maintenance_loop())
+
+async def post_shutdown(application):
+    """Сброс недописанной статистики и закрытие БД при остановке бота"""
+    batch = []
+    while not stats_queue.empty():
+        batch.append(stats_queue.get_nowait())
+    if batch:
+        await db_call(db.bulk_update_user_stats, batch)
+    await db_call(db.close)
+
 def main():
     """Запуск бота"""
-    # Создаем приложение
-    application = Application.builder().token(BOT_TOKEN).build()
+    # Создаем приложение: параллельная обработка апдейтов и увеличенный
+    # пул keep-alive соединений, чтобы всплески трафика не упирались
+    # в открытие новых TLS-соединений
+    application = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .concurrent_updates(256)
+        .pool_timeout(10)
+        .connection_pool_size(256)
+        .get_updates_connection_pool_size(8)
+        .build()
+    )
     
     # Команды модерации
     application.add_handler(CommandHandler("ban", ban_command))
@@ -800,22 +1023,36 @@ def main():
     application.add_handler(CommandHandler("add_badword", add_badword_command))
     application.add_handler(CommandHandler("remove_badword", remove_badword_command))
     
-    # Обработчики событий
+    # Обработчики событий (block=False: PTB не ждет завершения одного
+    # обработчика, чтобы начать следующий)
     application.add_handler(MessageHandler(
-        filters.StatusUpdate.NEW_CHAT_MEMBERS, 
-        handle_new_members
+        filters.StatusUpdate.NEW_CHAT_MEMBERS,
+        handle_new_members,
+        block=False
     ))
     application.add_handler(MessageHandler(
         filters.StatusUpdate.LEFT_CHAT_MEMBER,
-        handle_left_member
+        handle_left_member,
+        block=False
     ))
+    # Текстовый обработчик в отдельной группе, чтобы команды
+    # разбирались первыми и не проходили через текстовые фильтры
     application.add_handler(MessageHandler(
-        filters.TEXT & ~filters.COMMAND,
-        handle_messages
+        filters.TEXT & ~filters.COMMAND & ~filters.VIA_BOT,
+        handle_messages,
+        block=False
+    ), group=10)
+    
+    application.add_handler(ChatMemberHandler(
+        handle_chat_member_update,
+        ChatMemberHandler.ANY_CHAT_MEMBER
     ))
-    
+
     # Обработчик кнопок
     application.add_handler(CallbackQueryHandler(button_callback))
+
+    # Центральный обработчик ошибок
+    application.add_error_handler(global_error_handler)
     
     # Запускаем бота
     print("🤖 Бот запущен! Нажмите Ctrl+C для остановки.")
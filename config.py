@@ -1,10 +1,11 @@
 import os
 from dotenv import load_dotenv
 
-load_dotenv()
+load_dotenv(override=False)
 
-# Токен бота
-BOT_TOKEN = os.getenv("8057838212:AAGXJcxc4hEk5qzVjK37IocVDPC_hxj8nwA")
+# Токен бота (только из окружения/.env, в коде его быть не должно)
+BOT_TOKEN = os.getenv("BOT_TOKEN")
+assert BOT_TOKEN, "Не задана переменная окружения BOT_TOKEN"
 
 # Настройки по умолчанию
 DEFAULT_WARN_LIMIT = 3
@@ -1,19 +1,135 @@
 import sqlite3
 import json
-from datetime import datetime, timedelta
-from config import DATABASE_PATH
+import queue
+import re
+import time
+from contextlib import contextmanager
+from config import (
+    DATABASE_PATH, DEFAULT_WARN_LIMIT, DEFAULT_WELCOME_MESSAGE, DEFAULT_RULES
+)
+
+# SQL горячих путей: собираем строки один раз на импорте, а не в каждом
+# вызове (sqlite3 кэширует подготовленные запросы по идентичности текста)
+_SQL_SELECT_SETTINGS = "SELECT * FROM chat_settings WHERE chat_id = ?"
+
+_SQL_INSERT_WARNING = '''
+    INSERT INTO warnings (chat_id, user_id, warned_by, reason, created_at)
+    VALUES (?, ?, ?, ?, ?)
+'''
+
+_SQL_COUNT_WARNINGS_WITH_LIMIT = '''
+    SELECT COUNT(*),
+           COALESCE((SELECT warn_limit FROM chat_settings WHERE chat_id = ?), ?)
+    FROM warnings
+    WHERE chat_id = ? AND user_id = ?
+'''
+
+_SQL_COUNT_WARNINGS = '''
+    SELECT COUNT(*) FROM warnings
+    WHERE chat_id = ? AND user_id = ?
+'''
+
+_SQL_SELECT_MUTE = '''
+    SELECT mute_until FROM muted_users
+    WHERE chat_id = ? AND user_id = ?
+'''
+
+_SQL_UPSERT_STATS = '''
+    INSERT INTO user_stats (chat_id, user_id, messages_count, first_seen, last_seen)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(chat_id, user_id) DO UPDATE SET
+        messages_count = messages_count + excluded.messages_count,
+        last_seen = excluded.last_seen
+'''
+
+_SQL_SELECT_OVERVIEW = '''
+    SELECT s.messages_count, s.first_seen, s.last_seen,
+           (SELECT COUNT(*) FROM warnings
+            WHERE chat_id = q.chat_id AND user_id = q.user_id) AS warnings_count,
+           EXISTS(SELECT 1 FROM muted_users
+                  WHERE chat_id = q.chat_id AND user_id = q.user_id
+                    AND mute_until > ?) AS is_muted
+    FROM (SELECT ? AS chat_id, ? AS user_id) q
+    LEFT JOIN user_stats s ON s.chat_id = q.chat_id AND s.user_id = q.user_id
+'''
 
 class Database:
+    # Размер пула читающих соединений (под WAL читатели не ждут писателя)
+    READ_POOL_SIZE = 4
+
     def __init__(self):
         self.conn = sqlite3.connect(DATABASE_PATH, check_same_thread=False)
-        self.cursor = self.conn.cursor()
+        # Автокоммит: транзакциями управляем явно (важно для пакетных записей)
+        self.conn.isolation_level = None
+        # Row: dict(row) вместо ручного zip по cursor.description
+        self.conn.row_factory = sqlite3.Row
+        # WAL: писатель не блокирует читателей, коммит дешевле fsync'а
+        # rollback-журнала; плюс больше кэша страниц и mmap
+        self.conn.executescript('''
+            PRAGMA auto_vacuum=INCREMENTAL;
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=NORMAL;
+            PRAGMA temp_store=MEMORY;
+            PRAGMA cache_size=-20000;
+            PRAGMA mmap_size=268435456;
+        ''')
+        self.conn.execute("PRAGMA busy_timeout=5000")
+
+        # self.conn — единственный писатель; читающие методы берут
+        # соединение из этого пула и не сериализуются за коммитами
+        self._read_pool = queue.Queue()
+        for _ in range(self.READ_POOL_SIZE):
+            rconn = sqlite3.connect(DATABASE_PATH, check_same_thread=False)
+            rconn.row_factory = sqlite3.Row
+            rconn.executescript('''
+                PRAGMA synchronous=NORMAL;
+                PRAGMA temp_store=MEMORY;
+                PRAGMA cache_size=-20000;
+                PRAGMA mmap_size=268435456;
+            ''')
+            rconn.execute("PRAGMA busy_timeout=5000")
+            self._read_pool.put(rconn)
+
+        # Кэш настроек: chat_id -> dict, сбрасывается при любом изменении
+        self._settings_cache = {}
+        # Кэш плохих слов: chat_id -> (list[str], скомпилированный паттерн)
+        self._bad_words_cache = {}
         self.create_tables()
-    
+
+    def maintenance(self):
+        """Плановое обслуживание: усечь WAL и вернуть ОС свободные страницы
+
+        Вызывается фоновой задачей бота раз в несколько минут, чтобы WAL
+        не разрастался между рестартами.
+        """
+        # Истекшие муты убираем пачкой здесь, а не по одному из is_muted
+        self.conn.execute(
+            "DELETE FROM muted_users WHERE mute_until < ?", (int(time.time()),)
+        )
+        self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self.conn.execute("PRAGMA incremental_vacuum(1000)")
+
+    def close(self):
+        """Закрыть все соединения, предварительно слив WAL в основной файл"""
+        self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self.conn.close()
+        while not self._read_pool.empty():
+            self._read_pool.get_nowait().close()
+
+    @contextmanager
+    def _read_conn(self):
+        """Выдает читающее соединение из пула"""
+        conn = self._read_pool.get()
+        try:
+            yield conn
+        finally:
+            self._read_pool.put(conn)
+
     def create_tables(self):
         """Создание всех необходимых таблиц"""
         
         # Настройки чатов
-        self.cursor.execute('''
+        self.conn.execute('''
             CREATE TABLE IF NOT EXISTS chat_settings (
                 chat_id INTEGER PRIMARY KEY,
                 welcome_message TEXT,
@@ -29,130 +145,243 @@ class Database:
             )
         ''')
         
-        # Предупреждения пользователей
-        self.cursor.execute('''
+        # Предупреждения пользователей. Без UNIQUE(chat_id, user_id,
+        # created_at): при секундных метках он отбрасывал два варна,
+        # выданных в одну секунду, и содержал лишний индекс
+        self.conn.execute('''
             CREATE TABLE IF NOT EXISTS warnings (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 chat_id INTEGER,
                 user_id INTEGER,
                 warned_by INTEGER,
                 reason TEXT,
-                created_at TIMESTAMP,
-                UNIQUE(chat_id, user_id, created_at)
+                created_at INTEGER
             )
         ''')
-        
+        self._migrate_warnings_unique()
+
+
+        # Покрывающий индекс: COUNT и "последнее предупреждение" ходят
+        # только по индексу, без скана таблицы
+        self.conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_warnings_chat_user
+            ON warnings(chat_id, user_id, created_at DESC)
+        ''')
+
         # Заглушенные пользователи
-        self.cursor.execute('''
+        self.conn.execute('''
             CREATE TABLE IF NOT EXISTS muted_users (
                 chat_id INTEGER,
                 user_id INTEGER,
-                mute_until TIMESTAMP,
+                mute_until INTEGER,
                 PRIMARY KEY (chat_id, user_id)
             )
         ''')
         
         # Статистика пользователей
-        self.cursor.execute('''
+        self.conn.execute('''
             CREATE TABLE IF NOT EXISTS user_stats (
                 chat_id INTEGER,
                 user_id INTEGER,
                 messages_count INTEGER DEFAULT 0,
-                first_seen TIMESTAMP,
-                last_seen TIMESTAMP,
+                first_seen INTEGER,
+                last_seen INTEGER,
                 PRIMARY KEY (chat_id, user_id)
             )
         ''')
         
         self.conn.commit()
-    
+        self._migrate_text_timestamps()
+
+    def _migrate_warnings_unique(self):
+        """Перестраивает warnings без UNIQUE-ограничения (старые БД)"""
+        row = self.conn.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'warnings'"
+        ).fetchone()
+        if not row or 'UNIQUE' not in row[0]:
+            return
+
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            self.conn.execute('''
+                CREATE TABLE warnings_new (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    chat_id INTEGER,
+                    user_id INTEGER,
+                    warned_by INTEGER,
+                    reason TEXT,
+                    created_at INTEGER
+                )
+            ''')
+            self.conn.execute('''
+                INSERT INTO warnings_new (id, chat_id, user_id, warned_by, reason, created_at)
+                SELECT id, chat_id, user_id, warned_by, reason, created_at FROM warnings
+            ''')
+            self.conn.execute("DROP TABLE warnings")
+            self.conn.execute("ALTER TABLE warnings_new RENAME TO warnings")
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    # Колонки, в которых старые БД хранили ISO-строки вместо unix-времени
+    _TS_COLUMNS = (
+        ('warnings', 'created_at'),
+        ('muted_users', 'mute_until'),
+        ('user_stats', 'first_seen'),
+        ('user_stats', 'last_seen'),
+    )
+
+    def _migrate_text_timestamps(self):
+        """Переводит строковые метки времени старых БД в unix-секунды
+
+        До перехода на целые секунды даты писались как datetime.now()
+        по локальному времени, поэтому при конверсии строка трактуется
+        как localtime (модификатор 'utc').
+        """
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            for table, column in self._TS_COLUMNS:
+                self.conn.execute(f'''
+                    UPDATE {table}
+                    SET {column} = CAST(strftime('%s', {column}, 'utc') AS INTEGER)
+                    WHERE typeof({column}) = 'text'
+                ''')
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
     # === НАСТРОЙКИ ЧАТА ===
     
     def get_chat_settings(self, chat_id):
-        """Получить настройки чата"""
-        self.cursor.execute(
-            "SELECT * FROM chat_settings WHERE chat_id = ?",
-            (chat_id,)
-        )
-        settings = self.cursor.fetchone()
-        
+        """Получить настройки чата (через кэш); None, если чата еще нет в БД
+
+        Чистое чтение: можно звать из пула читателей. Строку по умолчанию
+        создает ensure_chat_settings через поток-писатель.
+        """
+        cached = self._settings_cache.get(chat_id)
+        if cached is not None:
+            return cached
+
+        with self._read_conn() as rconn:
+            cur = rconn.execute(_SQL_SELECT_SETTINGS, (chat_id,))
+            settings = cur.fetchone()
         if not settings:
-            # Создаем настройки по умолчанию
-            self.cursor.execute('''
-                INSERT INTO chat_settings (chat_id, welcome_message, rules)
-                VALUES (?, ?, ?)
-            ''', (chat_id, DEFAULT_WELCOME_MESSAGE, DEFAULT_RULES))
-            self.conn.commit()
-            
-            self.cursor.execute(
-                "SELECT * FROM chat_settings WHERE chat_id = ?",
-                (chat_id,)
-            )
-            settings = self.cursor.fetchone()
-        
-        # Преобразуем в словарь
-        columns = [description[0] for description in self.cursor.description]
-        return dict(zip(columns, settings))
+            return None
+
+        # Преобразуем в словарь и кэшируем
+        result = dict(settings)
+        self._settings_cache[chat_id] = result
+        return result
+
+    def ensure_chat_settings(self, chat_id):
+        """Создать настройки по умолчанию, если их нет, и вернуть их
+
+        Пишет в БД — вызывать только через поток-писатель.
+        """
+        self.conn.execute('''
+            INSERT OR IGNORE INTO chat_settings (chat_id, welcome_message, rules)
+            VALUES (?, ?, ?)
+        ''', (chat_id, DEFAULT_WELCOME_MESSAGE, DEFAULT_RULES))
+        self.conn.commit()
+
+        cur = self.conn.execute(_SQL_SELECT_SETTINGS, (chat_id,))
+        result = dict(cur.fetchone())
+        self._settings_cache[chat_id] = result
+        return result
     
     def update_welcome(self, chat_id, message):
         """Обновить приветствие"""
-        self.cursor.execute(
+        self.conn.execute(
             "UPDATE chat_settings SET welcome_message = ? WHERE chat_id = ?",
             (message, chat_id)
         )
         self.conn.commit()
+        self._settings_cache.pop(chat_id, None)
     
     def update_rules(self, chat_id, rules):
         """Обновить правила"""
-        self.cursor.execute(
+        self.conn.execute(
             "UPDATE chat_settings SET rules = ? WHERE chat_id = ?",
             (rules, chat_id)
         )
         self.conn.commit()
+        self._settings_cache.pop(chat_id, None)
     
     def update_bad_words(self, chat_id, words_list):
         """Обновить список плохих слов"""
-        self.cursor.execute(
+        self.conn.execute(
             "UPDATE chat_settings SET bad_words = ? WHERE chat_id = ?",
             (json.dumps(words_list), chat_id)
         )
         self.conn.commit()
-    
+        self._settings_cache.pop(chat_id, None)
+        # Новый список уже на руках — кладем в кэш сразу
+        self._bad_words_cache[chat_id] = self._compile_bad_words(list(words_list))
+
+    @staticmethod
+    def _compile_bad_words(words):
+        """Собирает (список, паттерн): все слова в одном регэкспе"""
+        pattern = None
+        if words:
+            pattern = re.compile('|'.join(map(re.escape, words)), re.IGNORECASE)
+        return (words, pattern)
+
+    def _load_bad_words(self, chat_id):
+        """Читает и парсит плохие слова из БД, кладет в кэш"""
+        with self._read_conn() as rconn:
+            cur = rconn.execute(
+                "SELECT bad_words FROM chat_settings WHERE chat_id = ?",
+                (chat_id,)
+            )
+            result = cur.fetchone()
+        words = json.loads(result[0]) if result and result[0] else []
+        cached = self._compile_bad_words(words)
+        self._bad_words_cache[chat_id] = cached
+        return cached
+
     def get_bad_words(self, chat_id):
-        """Получить список плохих слов"""
-        self.cursor.execute(
-            "SELECT bad_words FROM chat_settings WHERE chat_id = ?",
-            (chat_id,)
-        )
-        result = self.cursor.fetchone()
-        if result and result[0]:
-            return json.loads(result[0])
-        return []
+        """Получить список плохих слов (парсим JSON один раз, потом из кэша)"""
+        cached = self._bad_words_cache.get(chat_id) or self._load_bad_words(chat_id)
+        return cached[0]
+
+    def get_bad_words_compiled(self, chat_id):
+        """Получить (список, скомпилированный паттерн) для антимата"""
+        return self._bad_words_cache.get(chat_id) or self._load_bad_words(chat_id)
     
     # === ПРЕДУПРЕЖДЕНИЯ ===
     
     def add_warning(self, chat_id, user_id, warned_by, reason=None):
-        """Добавить предупреждение пользователю"""
-        self.cursor.execute('''
-            INSERT INTO warnings (chat_id, user_id, warned_by, reason, created_at)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (chat_id, user_id, warned_by, reason, datetime.now()))
-        self.conn.commit()
-        
-        # Получаем количество предупреждений
-        return self.get_warnings_count(chat_id, user_id)
+        """Добавить предупреждение; вернуть (количество, лимит) одной транзакцией"""
+        # Вставка и подсчет в одной транзакции: блокировка берется один
+        # раз, и COUNT гарантированно видит только что вставленную строку
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            self.conn.execute(
+                _SQL_INSERT_WARNING,
+                (chat_id, user_id, warned_by, reason, int(time.time()))
+            )
+            cur = self.conn.execute(
+                _SQL_COUNT_WARNINGS_WITH_LIMIT,
+                (chat_id, DEFAULT_WARN_LIMIT, chat_id, user_id)
+            )
+            warn_count, warn_limit = cur.fetchone()
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        return warn_count, warn_limit
     
     def get_warnings_count(self, chat_id, user_id):
         """Получить количество предупреждений пользователя"""
-        self.cursor.execute('''
-            SELECT COUNT(*) FROM warnings
-            WHERE chat_id = ? AND user_id = ?
-        ''', (chat_id, user_id))
-        return self.cursor.fetchone()[0]
+        with self._read_conn() as rconn:
+            cur = rconn.execute(_SQL_COUNT_WARNINGS, (chat_id, user_id))
+            return cur.fetchone()[0]
     
     def remove_warning(self, chat_id, user_id):
         """Удалить последнее предупреждение"""
-        self.cursor.execute('''
+        self.conn.execute('''
             DELETE FROM warnings
             WHERE id = (
                 SELECT id FROM warnings
@@ -166,7 +395,7 @@ class Database:
     
     def clear_warnings(self, chat_id, user_id):
         """Очистить все предупреждения пользователя"""
-        self.cursor.execute(
+        self.conn.execute(
             "DELETE FROM warnings WHERE chat_id = ? AND user_id = ?",
             (chat_id, user_id)
         )
@@ -175,18 +404,22 @@ class Database:
     # === МУТЫ ===
     
     def add_mute(self, chat_id, user_id, duration_seconds):
-        """Заглушить пользователя"""
-        mute_until = datetime.now() + timedelta(seconds=duration_seconds)
-        self.cursor.execute('''
-            INSERT OR REPLACE INTO muted_users (chat_id, user_id, mute_until)
+        """Заглушить пользователя; возвращает unix-время окончания мута"""
+        mute_until = int(time.time()) + duration_seconds
+        # UPSERT обновляет строку на месте; INSERT OR REPLACE удалял бы
+        # и вставлял ее заново на каждый повторный мут
+        self.conn.execute('''
+            INSERT INTO muted_users (chat_id, user_id, mute_until)
             VALUES (?, ?, ?)
+            ON CONFLICT(chat_id, user_id) DO UPDATE SET
+                mute_until = excluded.mute_until
         ''', (chat_id, user_id, mute_until))
         self.conn.commit()
         return mute_until
     
     def remove_mute(self, chat_id, user_id):
         """Снять заглушение"""
-        self.cursor.execute(
+        self.conn.execute(
             "DELETE FROM muted_users WHERE chat_id = ? AND user_id = ?",
             (chat_id, user_id)
         )
@@ -194,56 +427,61 @@ class Database:
     
     def is_muted(self, chat_id, user_id):
         """Проверить, заглушен ли пользователь"""
-        self.cursor.execute('''
-            SELECT mute_until FROM muted_users
-            WHERE chat_id = ? AND user_id = ?
-        ''', (chat_id, user_id))
-        
-        result = self.cursor.fetchone()
-        if not result:
-            return False
-        
-        mute_until = datetime.fromisoformat(result[0])
-        if mute_until > datetime.now():
-            return True
-        else:
-            # Мут истек, удаляем
-            self.remove_mute(chat_id, user_id)
-            return False
+        with self._read_conn() as rconn:
+            cur = rconn.execute(_SQL_SELECT_MUTE, (chat_id, user_id))
+            result = cur.fetchone()
+        # Чистое чтение: истекшие записи сметает maintenance(), поэтому
+        # метод можно гонять через пул читателей без записи в БД
+        return bool(result) and result[0] > int(time.time())
     
     # === СТАТИСТИКА ===
     
-    def update_user_stats(self, chat_id, user_id, username, first_name):
-        """Обновить статистику пользователя"""
-        now = datetime.now()
-        
-        self.cursor.execute('''
-            INSERT OR REPLACE INTO user_stats 
-            (chat_id, user_id, messages_count, first_seen, last_seen)
-            VALUES (?, ?, 
-                COALESCE(
-                    (SELECT messages_count + 1 FROM user_stats 
-                     WHERE chat_id = ? AND user_id = ?),
-                    1
-                ),
-                COALESCE(
-                    (SELECT first_seen FROM user_stats 
-                     WHERE chat_id = ? AND user_id = ?),
-                    ?
-                ),
-                ?)
-        ''', (chat_id, user_id, chat_id, user_id, chat_id, user_id, now, now))
-        self.conn.commit()
-    
+    def bulk_update_user_stats(self, rows):
+        """Пакетно обновить статистику (вызывается фоновым флашером)
+
+        rows: список кортежей (chat_id, user_id, ts)
+        """
+        # Схлопываем дельты по (chat_id, user_id): одна строка на пользователя,
+        # сколько бы сообщений он ни прислал за интервал флаша
+        merged = {}
+        for chat_id, user_id, ts in rows:
+            entry = merged.get((chat_id, user_id))
+            if entry is None:
+                merged[(chat_id, user_id)] = [1, ts, ts]
+            else:
+                entry[0] += 1
+                entry[2] = ts
+        params = [
+            (chat_id, user_id, count, int(first_ts), int(last_ts))
+            for (chat_id, user_id), (count, first_ts, last_ts) in merged.items()
+        ]
+
+        # Одна транзакция (и один fsync) на весь пакет
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            self.conn.executemany(_SQL_UPSERT_STATS, params)
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
     def get_user_stats(self, chat_id, user_id):
         """Получить статистику пользователя"""
-        self.cursor.execute('''
-            SELECT * FROM user_stats
-            WHERE chat_id = ? AND user_id = ?
-        ''', (chat_id, user_id))
-        
-        result = self.cursor.fetchone()
+        with self._read_conn() as rconn:
+            cur = rconn.execute('''
+                SELECT * FROM user_stats
+                WHERE chat_id = ? AND user_id = ?
+            ''', (chat_id, user_id))
+            result = cur.fetchone()
         if result:
-            columns = [description[0] for description in self.cursor.description]
-            return dict(zip(columns, result))
+            return dict(result)
         return None
+
+    def get_user_overview(self, chat_id, user_id):
+        """Статистика, предупреждения и статус мута одним запросом"""
+        with self._read_conn() as rconn:
+            cur = rconn.execute(
+                _SQL_SELECT_OVERVIEW, (int(time.time()), chat_id, user_id)
+            )
+            row = cur.fetchone()
+        return dict(row)
@@ -1,7 +1,23 @@
-import re
-from datetime import datetime, timedelta
+import logging
+from functools import lru_cache
+from cachetools import TTLCache
 from telegram import ChatPermissions
+from telegram.error import BadRequest, Forbidden
 
+logger = logging.getLogger(__name__)
+
+# Кэш списков администраторов (чтобы не дудосить Telegram API)
+admin_cache = TTLCache(maxsize=1000, ttl=300)  # 5 минут
+
+# Короткий мемо результата is_admin: (chat_id, user_id) -> bool.
+# Снимает обход списка админов на каждом сообщении; TTL маленький,
+# чтобы снятие админки подхватывалось быстро
+_ADMIN_MEMO_TTL = 60  # секунд
+_admin_memo = TTLCache(maxsize=10000, ttl=_ADMIN_MEMO_TTL)
+
+_TIME_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+@lru_cache(maxsize=256)
 def parse_time(time_str):
     """
     Парсит время из строки (5m, 1h, 2d)
@@ -9,67 +25,116 @@ def parse_time(time_str):
     """
     if not time_str:
         return None
-    
-    units = {
-        's': 1,
-        'm': 60,
-        'h': 3600,
-        'd': 86400
-    }
-    
-    match = re.match(r'(\d+)([smhd])', time_str.lower())
-    if match:
-        value, unit = match.groups()
-        return int(value) * units.get(unit, 60)
-    
-    return None
 
+    # Без регэкспа: суффикс из таблицы, число через int()
+    s = time_str.lower()
+    if len(s) < 2:
+        return None
+
+    unit = _TIME_UNITS.get(s[-1])
+    if unit is None:
+        return None
+
+    # Только цифры: int() принял бы и "-5", а отрицательный мут
+    # Telegram трактует как вечный
+    value = s[:-1]
+    if not value.isdigit():
+        return None
+    return int(value) * unit
+
+_TIME_TIERS = (
+    (86400, "дн"),
+    (3600, "ч"),
+    (60, "мин"),
+    (1, "сек"),
+)
+
+@lru_cache(maxsize=256)
 def format_time(seconds):
     """Форматирует секунды в человекочитаемый вид"""
-    if seconds < 60:
-        return f"{seconds} сек"
-    elif seconds < 3600:
-        return f"{seconds // 60} мин"
-    elif seconds < 86400:
-        return f"{seconds // 3600} ч"
-    else:
-        return f"{seconds // 86400} дн"
+    for divisor, suffix in _TIME_TIERS:
+        if seconds >= divisor:
+            return f"{seconds // divisor} {suffix}"
+    return f"{seconds} сек"
+
+# ChatPermissions неизменяемы, поэтому строим их один раз при импорте
+MUTE_PERMISSIONS = ChatPermissions(
+    can_send_messages=False,
+    can_send_audios=False,
+    can_send_documents=False,
+    can_send_photos=False,
+    can_send_videos=False,
+    can_send_video_notes=False,
+    can_send_voice_notes=False,
+    can_send_polls=False,
+    can_send_other_messages=False,
+    can_add_web_page_previews=False,
+    can_change_info=False,
+    can_invite_users=False,
+    can_pin_messages=False
+)
+
+DEFAULT_PERMISSIONS = ChatPermissions(
+    can_send_messages=True,
+    can_send_audios=True,
+    can_send_documents=True,
+    can_send_photos=True,
+    can_send_videos=True,
+    can_send_video_notes=True,
+    can_send_voice_notes=True,
+    can_send_polls=True,
+    can_send_other_messages=True,
+    can_add_web_page_previews=True,
+    can_change_info=False,
+    can_invite_users=True,
+    can_pin_messages=False
+)
 
 def create_mute_permissions():
-    """Создает права для заглушенного пользователя"""
-    return ChatPermissions(
-        can_send_messages=False,
-        can_send_media_messages=False,
-        can_send_polls=False,
-        can_send_other_messages=False,
-        can_add_web_page_previews=False,
-        can_change_info=False,
-        can_invite_users=False,
-        can_pin_messages=False
-    )
+    """Возвращает права для заглушенного пользователя"""
+    return MUTE_PERMISSIONS
 
 def create_default_permissions():
-    """Создает обычные права пользователя"""
-    return ChatPermissions(
-        can_send_messages=True,
-        can_send_media_messages=True,
-        can_send_polls=True,
-        can_send_other_messages=True,
-        can_add_web_page_previews=True,
-        can_change_info=False,
-        can_invite_users=True,
-        can_pin_messages=False
-    )
+    """Возвращает обычные права пользователя"""
+    return DEFAULT_PERMISSIONS
+
+def invalidate_admin_cache(chat_id):
+    """Сбрасывает кэш админов и мемо is_admin для чата"""
+    admin_cache.pop(chat_id, None)
+    for key in [k for k in _admin_memo if k[0] == chat_id]:
+        _admin_memo.pop(key, None)
+
+async def get_cached_admins(chat):
+    """Возвращает список администраторов чата через кэш"""
+    admins = admin_cache.get(chat.id)
+    if admins is None:
+        admins = await chat.get_administrators()
+        admin_cache[chat.id] = admins
+    return admins
 
 async def is_admin(update, context, user_id=None):
     """Проверяет, является ли пользователь администратором"""
     if user_id is None:
         user_id = update.effective_user.id
-    
+
     chat = update.effective_chat
-    
+
+    memo_key = (chat.id, user_id)
+    cached = _admin_memo.get(memo_key)
+    if cached is not None:
+        return cached
+
     try:
-        member = await chat.get_member(user_id)
-        return member.status in ['administrator', 'creator']
-    except:
+        admins = await get_cached_admins(chat)
+        result = any(admin.user.id == user_id for admin in admins)
+    except (BadRequest, Forbidden):
+        # Нет доступа к списку админов — считаем, что не админ
         return False
+    except Exception:
+        # Сетевые и прочие ошибки не глотаем: пусть дойдут до
+        # глобального обработчика и попадут в лог
+        logger.exception("Не удалось проверить права администратора в чате %s", chat.id)
+        raise
+
+    _admin_memo[memo_key] = result
+    return result